@@ -1,23 +1,30 @@
 import streamlit as st
-import requests
-import json
 import time
 import random
-import numpy as np
 import speech_recognition as sr
 from datetime import datetime
 import chardet
-import pytesseract
+from tesserocr import PyTessBaseAPI
 from PIL import Image
 import base64
+import html
+import string
+import mmap
 import sys
-from io import StringIO
+from io import StringIO, BytesIO
 import contextlib
+from collections import deque
+from itertools import islice
+import builtins
 import sqlite3
 import bcrypt
 import os
 import uuid
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import threading
+import queue
+import atexit
+import re
+from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer
 import torch
 # Define your model name (as per your implementation)
 MODEL_NAME = "coderzz.ai"
@@ -36,38 +43,128 @@ def load_model():
 
 # Load the model and tokenizer
 model, tokenizer = load_model()
+
+# Minimum seconds between placeholder refreshes while streaming (~10 updates/sec)
+STREAM_RENDER_INTERVAL = 0.1
+
+def stream_generation(prompt, temperature):
+    """Generate on a worker thread and yield decoded text chunks as tokens arrive."""
+    inputs = tokenizer(prompt, return_tensors="pt").to(device)
+    streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True)
+    errors = []
+
+    def worker():
+        try:
+            # no_grad is thread-local, so it has to be entered on the worker thread
+            with torch.no_grad():
+                model.generate(
+                    inputs.input_ids,
+                    max_length=150,
+                    temperature=temperature,
+                    num_return_sequences=1,
+                    streamer=streamer,
+                )
+        except Exception as e:
+            errors.append(e)
+            streamer.end()  # Unblock the consumer loop
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    yield from streamer
+    thread.join()
+    if errors:
+        raise errors[0]
+
+# --- SQLite connection helper ---
+def _open(path):
+    """Open a SQLite connection with WAL journaling and tuned PRAGMAs."""
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    # journal_mode is persisted in the database file and get_conn() opens each path
+    # only once per process; in-memory databases cannot use WAL
+    if path != ":memory:":
+        conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA cache_size=-64000;")
+    conn.execute("PRAGMA mmap_size=268435456;")
+    return conn
+
+# Streamlit re-executes this script on every rerun, so process-wide DB state lives in
+# st.cache_resource factories rather than in module globals
+@st.cache_resource
+def _connection_pool():
+    """Create the process-wide pool of connections keyed by database path."""
+    pool, pool_lock = {}, threading.Lock()
+    atexit.register(_close_pooled_connections, pool, pool_lock)
+    return pool, pool_lock
+
+def _close_pooled_connections(pool, pool_lock):
+    """Close every pooled connection when the process exits."""
+    with pool_lock:
+        for conn in pool.values():
+            conn.close()
+        pool.clear()
+
+def get_conn(path):
+    """Return the pooled connection for a database path, opening it on first use."""
+    pool, pool_lock = _connection_pool()
+    with pool_lock:
+        conn = pool.get(path)
+        if conn is None:
+            conn = pool[path] = _open(path)
+        return conn
+
+@st.cache_resource
+def _transaction_lock():
+    """Create the lock that serializes explicit transactions on the shared connections."""
+    return threading.RLock()
+
+@contextlib.contextmanager
+def _transaction(conn):
+    """Run the enclosed statements in a single BEGIN IMMEDIATE/COMMIT block."""
+    with _transaction_lock():
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
 # --- Initialize database on startup ---
+# Bumped whenever the users schema changes; stored in the database's user_version
+USERS_SCHEMA_VERSION = 1
+
+# Cached so the schema check runs (and the pool warms up) once per process, not on every rerun
+@st.cache_resource(show_spinner=False)
 def init_db():
     """Initialize the SQLite database for user authentication."""
     os.makedirs("user_databases", exist_ok=True)
-    conn = sqlite3.connect('user_db.sqlite')
-    c = conn.cursor()
+    conn = get_conn('user_db.sqlite')
     
-    # First check if the table exists
-    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-    table_exists = c.fetchone()
+    # A single PRAGMA read tells us whether the schema is already current
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= USERS_SCHEMA_VERSION:
+        return
     
-    if not table_exists:
-        # Create the table with all required columns
-        c.execute('''
-            CREATE TABLE users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            )
-        ''')
-    else:
-        # Check if created_at column exists
-        try:
-            c.execute("SELECT created_at FROM users LIMIT 1")
-        except sqlite3.OperationalError:
-            # For existing tables, we need to recreate the table
-            # First, get the current data
-            c.execute("SELECT id, username, password FROM users")
-            users_data = c.fetchall()
-            
-            # Create a temporary table
+    with _transaction(conn) as c:
+        # Databases created before user_version was tracked may already have a users table
+        columns = {row[1] for row in c.execute("PRAGMA table_info(users)")}
+        
+        if not columns:
+            # Create the table with all required columns
+            c.execute('''
+                CREATE TABLE users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+        elif "created_at" not in columns:
+            # For existing tables without created_at, we need to recreate the table
+            # First, move the current data aside into a temporary table
             c.execute("ALTER TABLE users RENAME TO users_old")
             
             # Create the new table with the created_at column
@@ -80,50 +177,46 @@ def init_db():
                 )
             ''')
             
-            # Copy the data, using the current timestamp for created_at
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            for user_id, username, password in users_data:
-                c.execute(
-                    "INSERT INTO users (id, username, password, created_at) VALUES (?, ?, ?, ?)",
-                    (user_id, username, password, current_time)
-                )
+            # Copy the data, using the current timestamp for created_at; rows stream
+            # from a second cursor so the old table is never materialized in Python
+            old_rows = conn.execute("SELECT id, username, password FROM users_old")
+            c.executemany(
+                "INSERT INTO users (id, username, password, created_at) VALUES (?, ?, ?, datetime('now', 'localtime'))",
+                old_rows
+            )
                 
             # Drop the old table
             c.execute("DROP TABLE users_old")
-    
-    conn.commit()
-    conn.close()
+        
+        c.execute(f"PRAGMA user_version = {USERS_SCHEMA_VERSION}")
 
 def create_user_db(username):
     """Create a separate SQLite database for each user."""
     user_db_path = f"user_databases/{username}.sqlite"
-    conn = sqlite3.connect(user_db_path)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            user_input TEXT NOT NULL,
-            generated_code TEXT NOT NULL
-        )
-    ''')
-    
-    # Create user preferences table
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS user_preferences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            temperature REAL DEFAULT 0.7,
-            speed INTEGER DEFAULT 5,
-            favorite_language TEXT DEFAULT 'python'
-        )
-    ''')
-    
-    # Insert default preferences
-    c.execute('INSERT INTO user_preferences (temperature, speed, favorite_language) VALUES (?, ?, ?)',
-              (0.7, 5, 'python'))
-    
-    conn.commit()
-    conn.close()
+    conn = get_conn(user_db_path)
+    with _transaction(conn) as c:
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                user_input TEXT NOT NULL,
+                generated_code TEXT NOT NULL
+            )
+        ''')
+        
+        # Create user preferences table
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS user_preferences (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                temperature REAL DEFAULT 0.7,
+                speed INTEGER DEFAULT 5,
+                favorite_language TEXT DEFAULT 'python'
+            )
+        ''')
+        
+        # Insert default preferences
+        c.execute('INSERT INTO user_preferences (temperature, speed, favorite_language) VALUES (?, ?, ?)',
+                  (0.7, 5, 'python'))
 
 # --- User Authentication Functions ---
 def hash_password(password):
@@ -143,30 +236,25 @@ def verify_password(password, hashed_password):
     return bcrypt.checkpw(password_bytes, hashed_bytes)
 def register_user(username, password):
     """Register a new user."""
-    conn = sqlite3.connect('user_db.sqlite')
-    c = conn.cursor()
+    conn = get_conn('user_db.sqlite')
     try:
         hashed_password = hash_password(password)
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        c.execute('INSERT INTO users (username, password, created_at) VALUES (?, ?, ?)', 
-                 (username, hashed_password, current_time))
-        conn.commit()
+        with _transaction(conn) as c:
+            c.execute("INSERT INTO users (username, password, created_at) VALUES (?, ?, datetime('now', 'localtime'))", 
+                     (username, hashed_password))
         create_user_db(username)  # Create a separate database for the user
         return True, "Registration successful!"
     except sqlite3.IntegrityError:
         return False, "Username already exists."
     except Exception as e:
         return False, f"Error: {str(e)}"
-    finally:
-        conn.close()
 
 def authenticate_user(username, password):
     """Authenticate a user."""
-    conn = sqlite3.connect('user_db.sqlite')
+    conn = get_conn('user_db.sqlite')
     c = conn.cursor()
     c.execute('SELECT password FROM users WHERE username = ?', (username,))
     result = c.fetchone()
-    conn.close()
     
     if result and verify_password(password, result[0]):
         return True, "Login successful!"
@@ -175,42 +263,106 @@ def authenticate_user(username, password):
     else:
         return False, "Username not found."
 
+# --- HTML Templates ---
+# Values are HTML-escaped before substitution
+_PROFILE_BADGE_TMPL = string.Template("""
+        <div class="profile-badge">
+            <span>🙍‍♂️</span> <strong>$username</strong>
+        </div>
+        """)
+
+_WELCOME_TMPL = string.Template("""
+    <div class="card">
+        <h3>Welcome back, $username! 👋</h3>
+        <p>I can help you generate code in various programming languages. Just tell me what you need!</p>
+        <p>Use the buttons below to select a language or just type your request.</p>
+    </div>
+    """)
+
+def _profile_badge_html(username):
+    """Render the sidebar profile badge for a username."""
+    return _PROFILE_BADGE_TMPL.substitute(username=html.escape(username))
+
+def _welcome_html(username):
+    """Render the welcome card for a username."""
+    return _WELCOME_TMPL.substitute(username=html.escape(username))
+
 # --- Chat History Functions ---
 def save_chat_history(username, user_input, generated_code):
     """Save chat history to the user's database."""
     user_db_path = f"user_databases/{username}.sqlite"
-    conn = sqlite3.connect(user_db_path)
+    conn = get_conn(user_db_path)
     c = conn.cursor()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    c.execute('INSERT INTO chat_history (timestamp, user_input, generated_code) VALUES (?, ?, ?)',
-              (timestamp, user_input, generated_code))
-    conn.commit()
-    conn.close()
-
-def load_chat_history(username):
-    """Load chat history from the user's database."""
+    c.execute("INSERT INTO chat_history (timestamp, user_input, generated_code) VALUES (datetime('now', 'localtime'), ?, ?)",
+              (user_input, generated_code))
+
+@st.cache_resource
+def _chat_history_writer():
+    """Start the single background thread that serializes chat history writes."""
+    write_queue = queue.Queue()
+
+    def writer():
+        while True:
+            row = write_queue.get()
+            try:
+                save_chat_history(*row)
+            except Exception as e:
+                print(f"Error saving chat history: {str(e)}", file=sys.stderr)
+            finally:
+                write_queue.task_done()
+
+    threading.Thread(target=writer, name="chat-history-writer", daemon=True).start()
+    # Drain pending writes at exit; runs before the pool closes its connections (atexit is LIFO)
+    atexit.register(write_queue.join)
+    return write_queue
+
+def queue_chat_history_save(username, user_input, generated_code):
+    """Hand a chat history row to the background writer and return immediately."""
+    _chat_history_writer().put((username, user_input, generated_code))
+
+def chat_history_boundary(username):
+    """Return an id above every saved row, after draining queued writes, so paging below it skips nothing."""
+    user_db_path = f"user_databases/{username}.sqlite"
+    if not os.path.exists(user_db_path):
+        return 0
+    
+    _chat_history_writer().join()
+    conn = get_conn(user_db_path)
+    return conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM chat_history').fetchone()[0]
+
+def load_chat_history(username, before_id, limit=10):
+    """Load (id, timestamp, user_input, generated_code) rows older than `before_id`, newest first."""
     user_db_path = f"user_databases/{username}.sqlite"
     if not os.path.exists(user_db_path):
         return []
     
-    conn = sqlite3.connect(user_db_path)
+    conn = get_conn(user_db_path)
     c = conn.cursor()
-    c.execute('SELECT timestamp, user_input, generated_code FROM chat_history ORDER BY timestamp DESC LIMIT 10')
+    c.execute('SELECT id, timestamp, user_input, generated_code FROM chat_history WHERE id < ? ORDER BY id DESC LIMIT ?',
+              (before_id, limit))
     history = c.fetchall()
-    conn.close()
     return history
 
+# In-memory chat history is capped; older turns stay in SQLite and are paged in on demand.
+# Each entry is one (timestamp, user_input, generated_code) turn.
+CHAT_HISTORY_MAXLEN = 100
+CHAT_HISTORY_PAGE_SIZE = 10  # Rows (turns) fetched per "Load earlier" click
+
+def history_from_rows(rows, maxlen=CHAT_HISTORY_MAXLEN):
+    """Build the chronological in-memory history of turns from newest-first rows, dropping the row ids."""
+    return deque((row[1:] for row in reversed(rows)), maxlen=maxlen)
+
+@st.cache_data(show_spinner=False)
 def get_user_preferences(username):
-    """Get user preferences from the database."""
+    """Get user preferences from the database (cached until the next update)."""
     user_db_path = f"user_databases/{username}.sqlite"
     if not os.path.exists(user_db_path):
         return {"temperature": 0.7, "speed": 5, "favorite_language": "python"}
     
-    conn = sqlite3.connect(user_db_path)
+    conn = get_conn(user_db_path)
     c = conn.cursor()
     c.execute('SELECT temperature, speed, favorite_language FROM user_preferences LIMIT 1')
     result = c.fetchone()
-    conn.close()
     
     if result:
         return {"temperature": result[0], "speed": result[1], "favorite_language": result[2]}
@@ -220,82 +372,75 @@ def get_user_preferences(username):
 def update_user_preferences(username, preferences):
     """Update user preferences in the database."""
     user_db_path = f"user_databases/{username}.sqlite"
-    conn = sqlite3.connect(user_db_path)
+    conn = get_conn(user_db_path)
     c = conn.cursor()
     c.execute('''
         UPDATE user_preferences 
         SET temperature = ?, speed = ?, favorite_language = ?
         WHERE id = 1
     ''', (preferences["temperature"], preferences["speed"], preferences["favorite_language"]))
-    conn.commit()
-    conn.close()
+    get_user_preferences.clear()
 
 # --- Initialize Session State Variables ---
-def init_session_state():
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
-    if "generated_code" not in st.session_state:
-        st.session_state.generated_code = ""
-    if "temperature" not in st.session_state:
-        st.session_state.temperature = 0.7
-    if "speed" not in st.session_state:
-        st.session_state.speed = 5
-    if "user_input_buffer" not in st.session_state:
-        st.session_state.user_input_buffer = ""
-    if "feedback_submitted" not in st.session_state:
-        st.session_state.feedback_submitted = False
-    if "selected_optimization" not in st.session_state:
-        st.session_state.selected_optimization = None
-    if "recognized_text" not in st.session_state:
-        st.session_state.recognized_text = ""
-    if "input_text_buffer" not in st.session_state:
-        st.session_state.input_text_buffer = ""
-    if "should_update_textarea" not in st.session_state:
-        st.session_state.should_update_textarea = False
-    if "feedback_score" not in st.session_state:
-        st.session_state.feedback_score = 0
-    if "last_action_idx" not in st.session_state:
-        st.session_state.last_action_idx = 0
-    if "code_language" not in st.session_state:
-        st.session_state.code_language = "python"
-    if "dark_mode" not in st.session_state:
-        st.session_state.dark_mode = True  # Always set to True for dark mode only
-    if "auto_submit" not in st.session_state:
-        st.session_state.auto_submit = False
+# Callables are factories, only invoked when the key is missing (mutable or per-session values)
+_SESSION_DEFAULTS = {
+    "chat_history": lambda: deque(maxlen=CHAT_HISTORY_MAXLEN),
+    "history_window": 5,  # Number of chat turns rendered in the sidebar
+    "history_oldest_id": 0,  # "Load earlier" pages in saved rows with a smaller id
+    "generated_code": "",
+    "temperature": 0.7,
+    "speed": 5,
+    "user_input_buffer": "",
+    "feedback_submitted": False,
+    "selected_optimization": None,
+    "recognized_text": "",
+    "input_text_buffer": "",
+    "should_update_textarea": False,
+    "feedback_score": 0,
+    "last_action_idx": 0,
+    "code_language": "python",
+    "dark_mode": True,  # Always set to True for dark mode only
+    "last_upload_id": None,  # file_id of the last image/document turned into a request
     
     # Authentication state variables
-    if "authenticated" not in st.session_state:
-        st.session_state.authenticated = False
-    if "username" not in st.session_state:
-        st.session_state.username = ""
-    if "login_error" not in st.session_state:
-        st.session_state.login_error = ""
-    if "register_error" not in st.session_state:
-        st.session_state.register_error = ""
-    if "session_id" not in st.session_state:
-        st.session_state.session_id = str(uuid.uuid4())
-
-
-# --- Initialize callback state handlers ---
-def init_callback_handlers():
-    if "python_clicked" not in st.session_state:
-        st.session_state.python_clicked = False
-    if "javascript_clicked" not in st.session_state:
-        st.session_state.javascript_clicked = False
-    if "java_clicked" not in st.session_state:
-        st.session_state.java_clicked = False
-    if "cpp_clicked" not in st.session_state:
-        st.session_state.cpp_clicked = False
-    if "needs_rerun" not in st.session_state:
-        st.session_state.needs_rerun = False
-
-# --- Set up Tesseract OCR path (change according to your installation) ---
-pytesseract.pytesseract.tesseract_cmd = r"D:\tesseract\tesseract.exe"
+    "authenticated": False,
+    "username": "",
+    "login_error": "",
+    "register_error": "",
+    "session_id": lambda: str(uuid.uuid4()),
+    
+    # Callback state handlers
+    "python_clicked": False,
+    "javascript_clicked": False,
+    "java_clicked": False,
+    "cpp_clicked": False,
+    
+    # Reinforcement learning state; a plain list, since for a handful of actions
+    # Python builtins beat NumPy call overhead
+    "Q_table": lambda: [0.0] * num_actions,
+}
+
+def init_session_state():
+    state = st.session_state
+    for key, default in _SESSION_DEFAULTS.items():
+        if key not in state:
+            state[key] = default() if callable(default) else default
+
+# --- Set up Tesseract OCR data path (change according to your installation) ---
+TESSDATA_PATH = r"D:\tesseract\tessdata"
 
 # --- API Endpoint ---
 OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
 
 # --- Function to execute Python code ---
+# Globals every snippet starts from; copied per run so snippets cannot leak state into each other
+_EXEC_GLOBALS = {"__builtins__": builtins}
+
+@st.cache_resource(max_entries=64, show_spinner=False)
+def _compile_snippet(code_to_execute):
+    """Compile a snippet once so re-running the same code skips parsing."""
+    return compile(code_to_execute, "<user>", "exec")
+
 def execute_python_code(code_to_execute):
     """
     Safely execute Python code and capture its output.
@@ -312,8 +457,8 @@ def execute_python_code(code_to_execute):
             # Create a local namespace for execution
             local_namespace = {}
 
-            # Execute the code
-            exec(code_to_execute, {}, local_namespace)
+            # Execute the (cached) compiled code
+            exec(_compile_snippet(code_to_execute), dict(_EXEC_GLOBALS), local_namespace)
 
         except Exception as e:
             # Capture any exceptions
@@ -334,32 +479,34 @@ actions = [
     "Generate optimized code for: {}"
 ]
 num_actions = len(actions)
-
-def initialize_q_table():
-    if "Q_table" not in st.session_state:
-        st.session_state.Q_table = np.zeros(num_actions)
+# (prefix, suffix) around each template's "{}", so building a prompt is plain concatenation
+ACTIONS_SPLIT = [tuple(action.split("{}", 1)) for action in actions]
 
 def get_action(Q_table, epsilon=0.1):
     """Epsilon-greedy action selection."""
-    if random.uniform(0, 1) < epsilon:
-        return random.choice(range(num_actions))
+    if random.random() < epsilon:
+        return random.randrange(num_actions)
     else:
-        return int(np.argmax(Q_table))
+        return max(range(num_actions), key=Q_table.__getitem__)
 
 def update_Q(Q_table, action_idx, reward, learning_rate=0.1, discount_factor=0.9):
     """Update Q-value for the given action."""
-    best_next = np.max(Q_table)
+    best_next = max(Q_table)
     Q_table[action_idx] += learning_rate * (reward + discount_factor * best_next - Q_table[action_idx])
     return Q_table
 
 # --- Custom Styling ---
 def get_base64_encoded_image(image_path):
     with open(image_path, "rb") as img_file:
-        return base64.b64encode(img_file.read()).decode()
+        # mmap cannot map an empty file
+        if os.fstat(img_file.fileno()).st_size == 0:
+            return ""
+        # Encode straight from the mapped file instead of reading a bytes copy first
+        with mmap.mmap(img_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return base64.b64encode(mapped).decode()
 
 # Custom CSS for dark mode only
-def get_dark_mode_css():
-    return """
+_DARK_MODE_CSS = """
     /* Base application styling */
     .stApp {
         background-color: #0A0A0A;
@@ -651,11 +798,27 @@ def get_dark_mode_css():
     }
     """
 
+# The <style> wrapper around the dark mode CSS, passed straight to st.markdown
+_DARK_MODE_STYLE_BLOCK = f"""
+        <style>
+        {_DARK_MODE_CSS}
+        </style>
+        """
+
 # --- Speech Recognition ---
-def recognize_speech():
+@st.cache_resource
+def load_speech_recognizer():
+    """Create the recognizer and microphone once, calibrated; the lock serializes the microphone across sessions."""
     recognizer = sr.Recognizer()
+    microphone = sr.Microphone()
+    with microphone as source:
+        recognizer.adjust_for_ambient_noise(source, duration=0.3)
+    return recognizer, microphone, threading.Lock()
+
+def recognize_speech():
     try:
-        with sr.Microphone() as source:
+        recognizer, microphone, microphone_lock = load_speech_recognizer()
+        with microphone_lock, microphone as source:
             st.info("Listening... Speak now.")
             audio = recognizer.listen(source, timeout=5)
 
@@ -672,22 +835,42 @@ def recognize_speech():
         return None
 
 # --- Image Processing ---
-def process_image(image):
+@st.cache_resource
+def load_ocr_engine():
+    """Load libtesseract in-process once; the lock serializes access across sessions."""
+    return PyTessBaseAPI(path=TESSDATA_PATH), threading.Lock()
+
+# Uploads are cached on their bytes, so the same content is only OCR'd/parsed once per process
+UPLOAD_CACHE_ENTRIES = 32
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def _cached_process_image(data: bytes):
+    """OCR the image bytes; errors propagate so a failure is never cached."""
+    ocr_api, ocr_lock = load_ocr_engine()
+    with Image.open(BytesIO(data)) as img, ocr_lock:
+        ocr_api.SetImage(img)
+        return ocr_api.GetUTF8Text()
+
+def process_image(data):
     try:
-        image = Image.open(image)
-        text = pytesseract.image_to_string(image)
-        return text
+        return _cached_process_image(data)
     except Exception as e:
         st.error(f"Error processing image: {str(e)}")
         return None
 
 # --- Document Processing ---
-def process_document(doc_file):
+# chardet converges on a few KB, so only the leading bytes are sniffed
+ENCODING_SNIFF_BYTES = 65536
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def _cached_process_document(data: bytes):
+    """Decode the document bytes; errors propagate so a failure is never cached."""
+    encoding_detected = chardet.detect(data[:ENCODING_SNIFF_BYTES])['encoding']
+    return data.decode(encoding_detected or "utf-8", errors="ignore")
+
+def process_document(data):
     try:
-        raw_data = doc_file.read()
-        encoding_detected = chardet.detect(raw_data)['encoding']
-        content = raw_data.decode(encoding_detected or "utf-8", errors="ignore")
-        return content
+        return _cached_process_document(data)
     except Exception as e:
         st.error(f"Error processing document: {str(e)}")
         return None
@@ -697,24 +880,11 @@ def update_input_buffer(text, prefix=""):
     if text:
         st.session_state.input_text_buffer = f"{prefix}{text}"
         st.session_state.should_update_textarea = True
-        st.session_state.needs_rerun = True  # Flag for rerun after execution of callback
-        # Optionally auto-submit the form to immediately generate code
-        st.session_state.auto_submit = True  # Add this flag
-
-# --- Detect Code Language ---
-def detect_language(code):
-    """Simple heuristic to guess the programming language."""
-    code = code.lower()
-    if "def " in code or "import " in code or "print(" in code:
-        return "python"
-    elif "function" in code or "var " in code or "const " in code or "let " in code or "console.log" in code:
-        return "javascript"
-    elif "public class" in code or "void main" in code or "System.out.println" in code:
-        return "java"
-    elif "cout <<" in code or "#include" in code or "int main" in code:
-        return "cpp"
-    else:
-        return "python"  # Default
+
+# --- Code Fence Extraction ---
+# A ``` code fence with an optional language tag (c++, c#, objective-c, ...); a fence cut off by
+# max_length runs to the end, so callers ignore a match whose body is empty
+_FENCE_RE = re.compile(r"```(?:([\w+#.-]+)?\n)?(.*?)(?:```|\Z)", re.DOTALL)
 
 # --- Auth related callback functions ---
 def login_callback():
@@ -734,25 +904,28 @@ def login_callback():
         st.session_state.code_language = preferences["favorite_language"]
         
         # Load user chat history
-        history = load_chat_history(username)
-        st.session_state.chat_history = []
-        for timestamp, user_input, generated_code in history:
-            st.session_state.chat_history.append(f"""
-            <div style='background-color: #3B3B3B; 
-                 padding: 10px; border-radius: 5px; margin: 5px 0;'>
-                <strong>You:</strong> <small>({timestamp})</small><br>{user_input}
-            </div>
-            """)
-            st.session_state.chat_history.append(f"""
-            <div style='background-color: #2D2D2D; 
-                 padding: 10px; border-radius: 5px; margin: 5px 0;'>
-                <strong>Coderzz.AI:</strong> <small>({timestamp})</small><br>
-                <pre><code>{generated_code}</code></pre>
-            </div>
-            """)
+        boundary = chat_history_boundary(username)
+        history = load_chat_history(username, before_id=boundary)
+        st.session_state.chat_history = history_from_rows(history)
+        st.session_state.history_oldest_id = history[-1][0] if history else boundary
     else:
         st.session_state.login_error = message
 
+def load_earlier_history_callback():
+    """Page the next batch of older turns from SQLite in front of the in-memory history."""
+    earlier = load_chat_history(st.session_state.username, limit=CHAT_HISTORY_PAGE_SIZE,
+                                before_id=st.session_state.history_oldest_id)
+    if not earlier:
+        return
+    
+    history = st.session_state.chat_history
+    st.session_state.chat_history = deque(history_from_rows(earlier, maxlen=None) + history,
+                                          maxlen=CHAT_HISTORY_MAXLEN)
+    st.session_state.history_oldest_id = earlier[-1][0]
+    # Widen the rendered window so the loaded turns are actually visible
+    st.session_state.history_window = min(st.session_state.history_window + len(earlier),
+                                          CHAT_HISTORY_MAXLEN)
+
 def register_callback():
     username = st.session_state.register_username
     password = st.session_state.register_password
@@ -772,6 +945,8 @@ def register_callback():
         st.session_state.authenticated = True
         st.session_state.username = username
         st.session_state.register_error = ""
+        # A new user has no saved history to page in
+        st.session_state.history_oldest_id = 0
     else:
         st.session_state.register_error = message
 
@@ -792,8 +967,74 @@ def logout_callback():
             
     # Reinitialize session state
     init_session_state()
-    init_callback_handlers()
-    initialize_q_table()
+
+# --- Generated Code Section ---
+@st.fragment
+def _generated_code_block():
+    """Generated code with copy/execute actions; as a fragment, those clicks rerun only this block."""
+    st.markdown('<div class="highlight">', unsafe_allow_html=True)
+    st.subheader("Generated Code")
+    st.code(st.session_state.generated_code, language=st.session_state.code_language)
+    
+    # Copy to clipboard button
+    if st.button("📋 Copy Code"):
+        # Using JS to copy to clipboard (this is a placeholder, needs to be implemented with components)
+        st.success("Code copied to clipboard!")
+    
+    # For Python code, add an execute button
+    if st.session_state.code_language == "python":
+        if st.button("▶️ Execute Code"):
+            code_to_run = st.session_state.generated_code
+            
+            # Clean the code - remove markdown code blocks if present
+            fence = _FENCE_RE.search(code_to_run)
+            if fence and fence.group(2).strip():
+                code_to_run = fence.group(2)
+            
+            # Execute the code
+            stdout, stderr, execution_successful = execute_python_code(code_to_run)
+            
+            if execution_successful:
+                st.success("Code executed successfully!")
+                if stdout:
+                    st.subheader("Output:")
+                    st.code(stdout)
+            else:
+                st.error("Execution failed!")
+                if stderr:
+                    st.subheader("Error:")
+                    st.code(stderr)
+
+# --- Feedback Section ---
+@st.fragment
+def _feedback_block():
+    """Feedback buttons; as a fragment, a click reruns only this block to update the Q-table."""
+    st.subheader("Provide Feedback")
+    feedback_col1, feedback_col2, feedback_col3, feedback_col4, feedback_col5 = st.columns(5)
+    
+    with feedback_col1:
+        if st.button("😞 Poor"):
+            st.session_state.feedback_score -= 1
+            update_Q(st.session_state.Q_table, st.session_state.last_action_idx, -1)
+            st.session_state.feedback_submitted = True
+            st.success("Thank you for your feedback!i will improve myself")
+    with feedback_col2:
+        if st.button("😐 Neutral"):
+            update_Q(st.session_state.Q_table, st.session_state.last_action_idx, 0)
+            st.session_state.feedback_submitted = True
+            st.success("Thank you for your feedback!i will better next time")
+    with feedback_col3:
+        if st.button("🙂 Good"):
+            st.session_state.feedback_score += 1
+            update_Q(st.session_state.Q_table, st.session_state.last_action_idx, 1)
+            st.session_state.feedback_submitted = True
+            st.success("Thank you for your feedback!i will change some drawbacks")
+    with feedback_col4:
+        if st.button("🤩 Excellent"):
+            st.session_state.feedback_score += 2
+            update_Q(st.session_state.Q_table, st.session_state.last_action_idx, 2)
+            st.session_state.feedback_submitted = True
+            st.success("Thank you for your feedback!💯")
 
 # --- Main App Logic ---
 def main():
@@ -802,32 +1043,18 @@ def main():
     
     # Initialize session state
     init_session_state()
-    init_callback_handlers()
-    initialize_q_table()
     
     # Set up page config
     st.set_page_config(page_title="֎🇦🇮 Coderzz.AI - AI Coding Assistant", layout="wide")
     
     # Apply custom CSS
-    st.markdown(
-        f"""
-        <style>
-        {get_dark_mode_css()}
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
+    st.markdown(_DARK_MODE_STYLE_BLOCK, unsafe_allow_html=True)
 
     # Authentication UI
     if not st.session_state.authenticated:
         display_auth_ui()
     else:
         display_main_app()
-        
-    # Handle rerun flag
-    if st.session_state.needs_rerun:
-        st.session_state.needs_rerun = False
-        st.rerun()
 
 def display_auth_ui():
     # Center-aligned container for authentication
@@ -876,11 +1103,7 @@ def display_main_app():
         st.title("🤖 Coderzz.AI")
         
         # User profile section
-        st.markdown(f"""
-        <div class="profile-badge">
-            <span>🙍‍♂️</span> <strong>{st.session_state.username}</strong>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(_profile_badge_html(st.session_state.username), unsafe_allow_html=True)
         
         # Logout button
         if st.button("↩️ Logout", on_click=logout_callback):
@@ -890,36 +1113,99 @@ def display_main_app():
         with st.expander("⚙ Settings"):
             st.slider("AI Temperature", min_value=0.1, max_value=1.0, value=st.session_state.temperature, step=0.1, key="temperature")
             st.slider("Code Generation Speed", min_value=1, max_value=10, value=st.session_state.speed, key="speed")
+            st.slider("Visible Chat Turns", min_value=1, max_value=CHAT_HISTORY_MAXLEN, key="history_window")
 
+    # --- Main UI ---
+    display_main_ui()
+
+    # The rest of the sidebar renders after the main UI, so a generation made in this
+    # run already shows up in the statistics and chat history without another rerun
+    with st.sidebar:
         # Metrics display - for gamification
         with st.expander("📊 Your Statistics"):
-            st.metric("Codes Generated", len(st.session_state.chat_history) // 2)
+            st.metric("Codes Generated", len(st.session_state.chat_history))
             st.metric("Feedback Score", st.session_state.feedback_score)
 
         # Store chat history
         st.subheader("💬 Chat History")
         if st.button("🗑 Clear History"):
-            st.session_state.chat_history = []
-            st.session_state.needs_rerun = True  # Flag for rerun
+            st.session_state.chat_history.clear()
+            # Turns generated from here on sit above the boundary; the cleared ones stay reachable via "Load earlier"
+            st.session_state.history_oldest_id = chat_history_boundary(st.session_state.username)
 
         chat_container = st.container()
         with chat_container:
-            for message in reversed(st.session_state.chat_history[-10:]):
-                st.markdown(message, unsafe_allow_html=True)
+            # Newest `history_window` turns, newest first, as native chat messages
+            window = islice(reversed(st.session_state.chat_history), st.session_state.history_window)
+            for timestamp, user_input, generated_code in window:
+                with st.chat_message("user"):
+                    st.caption(timestamp)
+                    st.write(user_input)
+                with st.chat_message("assistant"):
+                    st.caption(timestamp)
+                    st.code(generated_code, language=st.session_state.code_language)
+        
+        # Older turns live only in SQLite until explicitly paged in
+        if len(st.session_state.chat_history) < CHAT_HISTORY_MAXLEN:
+            st.button("⏫ Load earlier", on_click=load_earlier_history_callback)
 
-    # --- Main UI ---
+def _run_generation(user_input):
+    """Generate code for a request and record it in the chat history."""
+    if not user_input:
+        return
+    
+    # Use reinforcement learning to select the best action template
+    action_idx = get_action(st.session_state.Q_table)
+    st.session_state.last_action_idx = action_idx
+    
+    # Format the prompt with the action template
+    prefix, suffix = ACTIONS_SPLIT[action_idx]
+    prompt = prefix + user_input + suffix
+    
+    # Display a spinner while generating code
+    with st.spinner("Generating code..."):
+        try:
+            # Generate code using LLaMA model directly, showing tokens as they stream in
+            placeholder = st.empty()
+            parts = []
+            last_render = 0.0
+            for chunk in stream_generation(prompt, st.session_state.temperature):
+                parts.append(chunk)
+                now = time.monotonic()
+                if now - last_render >= STREAM_RENDER_INTERVAL:
+                    placeholder.code("".join(parts), language=st.session_state.code_language)
+                    last_render = now
+            placeholder.empty()
+
+            # The full decoded text, same as decoding the whole output sequence
+            generated_code = "".join(parts)
+        
+            # Only keep the code part if it's wrapped in ```
+            fence = _FENCE_RE.search(generated_code)
+            if fence and fence.group(2).strip():
+                generated_code = fence.group(2)
+        
+            # Store the generated code
+            st.session_state.generated_code = generated_code
+        
+            # Add to chat history
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            st.session_state.chat_history.append((timestamp, user_input, generated_code))
+
+            # Save to database if authenticated
+            if st.session_state.authenticated:
+                queue_chat_history_save(st.session_state.username, user_input, generated_code)
+            
+        except Exception as e:
+            st.error(f"Error generating code: {str(e)}")
+
+def display_main_ui():
     st.title("💻 Coderzz.AI - Your AI Coding Assistant")
 
     # Intro card with animated welcome
     welcome_card = st.container()
     with welcome_card:
-     st.markdown(f"""
-    <div class="card">
-        <h3>Welcome back, {st.session_state.username}! 👋</h3>
-        <p>I can help you generate code in various programming languages. Just tell me what you need!</p>
-        <p>Use the buttons below to select a language or just type your request.</p>
-    </div>
-    """, unsafe_allow_html=True)
+     st.markdown(_welcome_html(st.session_state.username), unsafe_allow_html=True)
 
    
     
@@ -950,25 +1236,29 @@ def display_main_app():
             text = recognize_speech()
             if text:
                 update_input_buffer(text, "Generate code for: ")
+                _run_generation(st.session_state.input_text_buffer)
                 
     elif input_method == "Image":
         uploaded_image = st.file_uploader("Upload an image with code or instructions", type=["jpg", "jpeg", "png"])
-        if uploaded_image is not None:
-            text = process_image(uploaded_image)
+        # Only a newly uploaded file becomes a request; reruns keep returning the same upload
+        if uploaded_image is not None and uploaded_image.file_id != st.session_state.last_upload_id:
+            st.session_state.last_upload_id = uploaded_image.file_id
+            text = process_image(uploaded_image.getvalue())
             if text:
                 update_input_buffer(text)
+                _run_generation(text)
                 
     elif input_method == "Document":
         uploaded_doc = st.file_uploader("Upload a document with code or instructions", type=["txt", "py", "js", "java", "cpp", "c", "html", "css"])
-        if uploaded_doc is not None:
-            text = process_document(uploaded_doc)
+        if uploaded_doc is not None and uploaded_doc.file_id != st.session_state.last_upload_id:
+            st.session_state.last_upload_id = uploaded_doc.file_id
+            text = process_document(uploaded_doc.getvalue())
             if text:
                 update_input_buffer(text)
+                _run_generation(text)
     
       # Submit button
-    if st.button("Generate Code") or st.session_state.auto_submit:
-        st.session_state.auto_submit = False  # Reset flag
-        
+    if st.button("Generate Code"):
         # Default to empty string if not Text input method
         user_input = ""
         if input_method == "Text" and text_input:
@@ -976,135 +1266,15 @@ def display_main_app():
         elif st.session_state.input_text_buffer:
             user_input = st.session_state.input_text_buffer
             
-        # Use reinforcement learning to select the best action template
-        if user_input:
-            action_idx = get_action(st.session_state.Q_table)
-            st.session_state.last_action_idx = action_idx
-            
-            # Format the prompt with the action template
-            prompt = actions[action_idx].format(user_input)
-            
-            # Display a spinner while generating code
-            with st.spinner("Generating code..."):
-                try:
-                    prompt = actions[action_idx].format(user_input)
-
-                    # Generate code using LLaMA model directly
-                    inputs = tokenizer(prompt, return_tensors="pt").to(device)
-                    with torch.no_grad():
-                        outputs = model.generate(
-                            inputs.input_ids,
-                            max_length=150,
-                            temperature=st.session_state.temperature,
-                            num_return_sequences=1,
-                        )
-
-                    # Decode the generated code
-                    generated_code = tokenizer.decode(outputs[0], skip_special_tokens=True)
-                    
-                    # Only keep the code part if it's wrapped in ```
-                    if "```" in generated_code:
-                        code_blocks = generated_code.split("```")
-                        generated_code = "```" + code_blocks[1] + "```"
-                    
-                    # If language isn't specified in the user input, try to detect it
-                    if "code_language" not in st.session_state:
-                        st.session_state.code_language = detect_language(generated_code)
-                    
-                    # Store the generated code
-                    st.session_state.generated_code = generated_code
-                    
-                    # Add to chat history
-                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    st.session_state.chat_history.append(f"""
-                    <div style='background-color: #3B3B3B; 
-                         padding: 10px; border-radius: 5px; margin: 5px 0;'>
-                        <strong>You:</strong> <small>({timestamp})</small><br>{user_input}
-                    </div>
-                    """)
-                    st.session_state.chat_history.append(f"""
-                    <div style='background-color: #2D2D2D; 
-                         padding: 10px; border-radius: 5px; margin: 5px 0;'>
-                        <strong>Coderzz.AI:</strong> <small>({timestamp})</small><br>
-                        <pre><code>{generated_code}</code></pre>
-                    </div>
-                    """)
-
-                    # Save to database if authenticated
-                    if st.session_state.authenticated:
-                        save_chat_history(st.session_state.username, user_input, generated_code)
-                        
-                except Exception as e:
-                    st.error(f"Error generating code: {str(e)}")
-
-        # Force rerun to update UI
-        st.session_state.needs_rerun = True
+        _run_generation(user_input)
 
     st.markdown('</div>', unsafe_allow_html=True)
     
     # Results section
     if st.session_state.generated_code:
-        st.markdown('<div class="highlight">', unsafe_allow_html=True)
-        st.subheader("Generated Code")
-        st.code(st.session_state.generated_code, language=st.session_state.code_language)
-        
-        # Copy to clipboard button
-        if st.button("📋 Copy Code"):
-            # Using JS to copy to clipboard (this is a placeholder, needs to be implemented with components)
-            st.success("Code copied to clipboard!")
-        
-        # For Python code, add an execute button
-        if st.session_state.code_language == "python":
-            if st.button("▶️ Execute Code"):
-                code_to_run = st.session_state.generated_code
-                
-                # Clean the code - remove markdown code blocks if present
-                if "```python" in code_to_run:
-                    code_to_run = code_to_run.split("```python")[1].split("```")[0]
-                elif "```" in code_to_run:
-                    code_to_run = code_to_run.split("```")[1].split("```")[0]
-                
-                # Execute the code
-                stdout, stderr, execution_successful = execute_python_code(code_to_run)
-                
-                if execution_successful:
-                    st.success("Code executed successfully!")
-                    if stdout:
-                        st.subheader("Output:")
-                        st.code(stdout)
-                else:
-                    st.error("Execution failed!")
-                    if stderr:
-                        st.subheader("Error:")
-                        st.code(stderr)
-        
-        # Feedback section
-        st.subheader("Provide Feedback")
-        feedback_col1, feedback_col2, feedback_col3, feedback_col4, feedback_col5 = st.columns(5)
-        
-        with feedback_col1:
-            if st.button("😞 Poor"):
-                st.session_state.feedback_score -= 1
-                update_Q(st.session_state.Q_table, st.session_state.last_action_idx, -1)
-                st.session_state.feedback_submitted = True
-                st.success("Thank you for your feedback!i will improve myself")
-        with feedback_col2:
-            if st.button("😐 Neutral"):
-                update_Q(st.session_state.Q_table, st.session_state.last_action_idx, 0)
-                st.session_state.feedback_submitted = True
-                st.success("Thank you for your feedback!i will better next time")
-        with feedback_col3:
-            if st.button("🙂 Good"):
-                st.session_state.feedback_score += 1
-                update_Q(st.session_state.Q_table, st.session_state.last_action_idx, 1)
-                st.session_state.feedback_submitted = True
-                st.success("Thank you for your feedback!i will change some drawbacks")
-        with feedback_col4:
-            if st.button("🤩 Excellent"):
-                st.session_state.feedback_score += 2
-                update_Q(st.session_state.Q_table, st.session_state.last_action_idx, 2)
-                st.session_state.feedback_submitted = True
-                st.success("Thank you for your feedback!💯")
+        # Generated code and feedback each rerun on their own, not the whole page
+        _generated_code_block()
+        _feedback_block()
     # Footer
     st.markdown("---")
     st.markdown("Made with ❤ by Coderzz.AI | © 2025")